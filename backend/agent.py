@@ -5,55 +5,84 @@ Defines tools for creating and editing presentations,
 and provides the main agent streaming function using OpenAI SDK.
 """
 
-import uuid
+import re
+import secrets
 import logging
 import json
 import asyncio
+import inspect
+import itertools
 from typing import Any, AsyncGenerator, Optional, List, Dict
-from contextvars import ContextVar
 
 from models import Presentation, Slide, SlideLayout, PendingEdit
 from session import PresentationSession, session_manager
 
 logger = logging.getLogger(__name__)
 
-# Context variable for current session (async-safe)
-_current_session: ContextVar[Optional[PresentationSession]] = ContextVar(
-    'current_session',
-    default=None
-)
+# Map layout names to SlideLayout members without raising on unknown names
+_LAYOUT_LOOKUP = {layout.value: layout for layout in SlideLayout}
 
+# Use orjson for tool argument/result and event JSON if available
+try:
+    import orjson
 
-def get_current_session() -> Optional[PresentationSession]:
-    """Get the current session from context."""
-    return _current_session.get()
+    def _json_loads(data: str) -> Any:
+        return orjson.loads(data)
 
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
 
-def set_current_session(session: Optional[PresentationSession]):
-    """Set the current session in context."""
-    _current_session.set(session)
+    def _json_dumps_event(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str)
+except ImportError:
+    def _json_loads(data: str) -> Any:
+        return json.loads(data)
 
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+    def _json_dumps_event(obj: Any) -> bytes:
+        return json.dumps(obj, default=str).encode()
+
+# Precompiled patterns for extracting text from slide HTML
+_HEADING_RE = re.compile(r'<h[12][^>]*>([^<]+)</h[12]>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_LI_RE = re.compile(r'<li[^>]*>(.*?)</li>', re.IGNORECASE | re.DOTALL)
+_P_RE = re.compile(r'<p[^>]*>(.*?)</p>', re.IGNORECASE | re.DOTALL)
+_SCRIPT_RE = re.compile(r'<script[^>]*>.*?</script>', re.IGNORECASE | re.DOTALL)
+_STYLE_RE = re.compile(r'<style[^>]*>.*?</style>', re.IGNORECASE | re.DOTALL)
+_H12_STRIP_RE = re.compile(r'<h[12][^>]*>.*?</h[12]>', re.IGNORECASE | re.DOTALL)
+_BLOCK_CLOSE_RE = re.compile(r'</(?:div|p|li|br)[^>]*>', re.IGNORECASE)
+_BR_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+# Tags and whitespace runs both collapse to a single space in slide previews
+_PREVIEW_RE = re.compile(r'(?:<[^>]*>|\s)+')
 
 # Global registries for tools
 OPENAI_TOOLS: List[Dict[str, Any]] = []
 TOOL_FUNCTIONS: Dict[str, Any] = {}
 
+# Tools that only read session state and may be executed concurrently
+READ_ONLY_TOOLS = {"list_slides", "get_slide", "get_pending_edits"}
+
+# Shared tool error results; callers only serialize these, never mutate them
+_ERR_NO_PRESENTATION_USE_CREATE = {"error": "No presentation created. Use create_presentation first."}
+_ERR_NO_PRESENTATION_LOADED = {"error": "No presentation loaded"}
+_ERR_NO_PRESENTATION_CREATED = {"error": "No presentation created"}
+
+
+_PY_TO_JSON_TYPE = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    dict: "object",
+    list: "array",
+}
+
 
 def python_type_to_json_type(py_type: Any) -> str:
     """Convert Python type to JSON schema type."""
-    if py_type is str:
-        return "string"
-    if py_type is int:
-        return "integer"
-    if py_type is float:
-        return "number"
-    if py_type is bool:
-        return "boolean"
-    if py_type is dict:
-        return "object"
-    if py_type is list:
-        return "array"
-    return "string"
+    return _PY_TO_JSON_TYPE.get(py_type, "string")
 
 
 def tool(name: str, description: str, params: Dict[str, Any]):
@@ -61,15 +90,14 @@ def tool(name: str, description: str, params: Dict[str, Any]):
     def decorator(func):
         TOOL_FUNCTIONS[name] = func
 
-        properties = {}
-        required = []
-
-        for param_name, param_type in params.items():
-            properties[param_name] = {"type": python_type_to_json_type(param_type)}
-            # We make all parameters required to ensure the model provides them
-            # This simplifies things. The model is usually smart enough to provide defaults if we explained them in description,
-            # but for structured output, explicit is better.
-            required.append(param_name)
+        properties = {
+            param_name: {"type": python_type_to_json_type(param_type)}
+            for param_name, param_type in params.items()
+        }
+        # We make all parameters required to ensure the model provides them
+        # This simplifies things. The model is usually smart enough to provide defaults if we explained them in description,
+        # but for structured output, explicit is better.
+        required = list(params)
 
         tool_def = {
             "type": "function",
@@ -92,16 +120,21 @@ def tool(name: str, description: str, params: Dict[str, Any]):
 # TOOL DEFINITIONS
 # =============================================================================
 
+def _new_edit_id() -> str:
+    """Generate an opaque ID for a pending edit."""
+    # Pending edits are persisted with the session, so a process-local counter
+    # could collide after a restart; 64 random bits avoid that without
+    # building a full UUID object.
+    return secrets.token_hex(8)
+
+
 @tool("create_presentation", "Create a new presentation. Title is required.", {"title": str})
-async def tool_create_presentation(args: dict[str, Any]) -> dict[str, Any]:
+def tool_create_presentation(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Create a new presentation with the given title."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
-
     title = args.get("title", "Untitled Presentation")
     session.presentation = Presentation(title=title)
     session.pending_edits = []
+    session.pending_add_count = 0
     session.applied_edits = []
 
     return {"success": True, "title": title, "slide_count": 0}
@@ -112,13 +145,10 @@ async def tool_create_presentation(args: dict[str, Any]) -> dict[str, Any]:
     "position": int,
     "layout": str
 })
-async def tool_add_slide(args: dict[str, Any]) -> dict[str, Any]:
+def tool_add_slide(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Add a new slide to the presentation."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation created. Use create_presentation first."}
+        return _ERR_NO_PRESENTATION_USE_CREATE
 
     html = args.get("html", "")
     position = args.get("position")
@@ -128,30 +158,27 @@ async def tool_add_slide(args: dict[str, Any]) -> dict[str, Any]:
     if position == -1:
         position = None
 
-    try:
-        layout = SlideLayout(layout_str)
-    except ValueError:
-        layout = SlideLayout.BLANK
+    layout = _LAYOUT_LOOKUP.get(layout_str, SlideLayout.BLANK)
 
-    # Count pending ADD edits to calculate correct index
-    pending_add_count = sum(1 for e in session.pending_edits if e.operation == "ADD")
-    current_slide_count = len(session.presentation.slides)
+    # Account for pending ADD edits to calculate correct index
+    next_index = len(session.presentation.slides) + session.pending_add_count
 
     # Determine position
-    if position is None or position >= (current_slide_count + pending_add_count):
-        index = current_slide_count + pending_add_count
+    if position is None or position >= next_index:
+        index = next_index
     else:
-        index = max(0, position)
+        index = max(0, int(position))
 
     # Create pending edit
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=_new_edit_id(),
         slide_index=index,
         operation="ADD",
         params={"html": html, "layout": layout.value},
         preview=f"Add slide at position {index + 1}"
     )
     session.pending_edits.append(edit)
+    session.pending_add_count += 1
 
     return {"success": True, "slide_index": index, "edit_id": edit.edit_id}
 
@@ -160,22 +187,20 @@ async def tool_add_slide(args: dict[str, Any]) -> dict[str, Any]:
     "slide_index": int,
     "html": str
 })
-async def tool_update_slide(args: dict[str, Any]) -> dict[str, Any]:
+def tool_update_slide(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Update the content of an existing slide."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation loaded"}
+        return _ERR_NO_PRESENTATION_LOADED
 
     slide_index = args.get("slide_index", 0)
     html = args.get("html", "")
+    num_slides = len(session.presentation.slides)
 
-    if slide_index < 0 or slide_index >= len(session.presentation.slides):
+    if slide_index < 0 or slide_index >= num_slides:
         return {"error": f"Invalid slide index: {slide_index}"}
 
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=_new_edit_id(),
         slide_index=slide_index,
         operation="UPDATE",
         params={"html": html},
@@ -187,21 +212,19 @@ async def tool_update_slide(args: dict[str, Any]) -> dict[str, Any]:
 
 
 @tool("delete_slide", "Delete a slide from the presentation", {"slide_index": int})
-async def tool_delete_slide(args: dict[str, Any]) -> dict[str, Any]:
+def tool_delete_slide(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Delete a slide from the presentation."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation loaded"}
+        return _ERR_NO_PRESENTATION_LOADED
 
     slide_index = args.get("slide_index", 0)
+    num_slides = len(session.presentation.slides)
 
-    if slide_index < 0 or slide_index >= len(session.presentation.slides):
+    if slide_index < 0 or slide_index >= num_slides:
         return {"error": f"Invalid slide index: {slide_index}"}
 
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=_new_edit_id(),
         slide_index=slide_index,
         operation="DELETE",
         params={},
@@ -216,13 +239,10 @@ async def tool_delete_slide(args: dict[str, Any]) -> dict[str, Any]:
     "from_index": int,
     "to_index": int
 })
-async def tool_reorder_slides(args: dict[str, Any]) -> dict[str, Any]:
+def tool_reorder_slides(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Reorder slides in the presentation."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation loaded"}
+        return _ERR_NO_PRESENTATION_LOADED
 
     from_index = args.get("from_index", 0)
     to_index = args.get("to_index", 0)
@@ -234,7 +254,7 @@ async def tool_reorder_slides(args: dict[str, Any]) -> dict[str, Any]:
         return {"error": f"Invalid to_index: {to_index}"}
 
     edit = PendingEdit(
-        edit_id=str(uuid.uuid4()),
+        edit_id=_new_edit_id(),
         slide_index=from_index,
         operation="REORDER",
         params={"to_index": to_index},
@@ -246,21 +266,15 @@ async def tool_reorder_slides(args: dict[str, Any]) -> dict[str, Any]:
 
 
 @tool("list_slides", "List all slides in the presentation. No parameters required.", {"dummy": str})
-async def tool_list_slides(args: dict[str, Any]) -> dict[str, Any]:
+def tool_list_slides(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """List all slides with their index and content preview."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
         return {"slides": [], "count": 0}
 
-    import re
     slides = []
     for slide in session.presentation.slides:
-        # Create a preview by stripping HTML and truncating
-        preview = slide.html[:200].replace('<', ' <').replace('>', '> ')
-        preview = re.sub(r'<[^>]+>', '', preview).strip()
-        preview = ' '.join(preview.split())[:100]
+        # Create a preview by stripping HTML, collapsing whitespace and truncating
+        preview = _PREVIEW_RE.sub(' ', slide.html[:300]).strip()[:100]
 
         slides.append({
             "index": slide.index,
@@ -273,20 +287,19 @@ async def tool_list_slides(args: dict[str, Any]) -> dict[str, Any]:
 
 
 @tool("get_slide", "Get full details of a specific slide", {"slide_index": int})
-async def tool_get_slide(args: dict[str, Any]) -> dict[str, Any]:
+def tool_get_slide(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Get the full HTML content and details of a slide."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation loaded"}
+        return _ERR_NO_PRESENTATION_LOADED
 
     slide_index = args.get("slide_index", 0)
 
-    if slide_index < 0 or slide_index >= len(session.presentation.slides):
+    slides = session.presentation.slides
+
+    if slide_index < 0 or slide_index >= len(slides):
         return {"error": f"Invalid slide index: {slide_index}"}
 
-    slide = session.presentation.slides[slide_index]
+    slide = slides[slide_index]
     return {
         "index": slide.index,
         "html": slide.html,
@@ -296,13 +309,10 @@ async def tool_get_slide(args: dict[str, Any]) -> dict[str, Any]:
 
 
 @tool("set_theme", "Set the presentation theme (colors, fonts)", {"theme": dict})
-async def tool_set_theme(args: dict[str, Any]) -> dict[str, Any]:
+def tool_set_theme(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Set the presentation theme."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation created"}
+        return _ERR_NO_PRESENTATION_CREATED
 
     theme = args.get("theme", {})
     session.presentation.theme = theme
@@ -311,12 +321,8 @@ async def tool_set_theme(args: dict[str, Any]) -> dict[str, Any]:
 
 
 @tool("get_pending_edits", "Get all pending edits that haven't been committed. No parameters required.", {"dummy": str})
-async def tool_get_pending_edits(args: dict[str, Any]) -> dict[str, Any]:
+def tool_get_pending_edits(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Get all pending edits."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
-
     edits = [
         {
             "edit_id": e.edit_id,
@@ -330,63 +336,123 @@ async def tool_get_pending_edits(args: dict[str, Any]) -> dict[str, Any]:
     return {"edits": edits, "count": len(edits)}
 
 
+def _insert_slides(slides: list[Slide], new_slides: list[Slide]) -> None:
+    """
+    Insert slides in place as if each were inserted at its index in turn.
+
+    new_slides must have strictly increasing indices, so each slide lands
+    after the previously inserted one and the result can be built in a single
+    pass rather than shifting the tail of the list once per slide.
+    """
+    if new_slides[0].index >= len(slides):
+        slides.extend(new_slides)
+        return
+
+    merged = []
+    remaining = iter(slides)
+    for slide in new_slides:
+        merged.extend(itertools.islice(remaining, slide.index - len(merged)))
+        merged.append(slide)
+    merged.extend(remaining)
+    slides[:] = merged
+
+
+def _record_applied_edit(session: PresentationSession, edit: PendingEdit) -> None:
+    """Append a committed edit to the session's applied edit history."""
+    session.applied_edits.append({
+        "edit_id": edit.edit_id,
+        "slide_index": edit.slide_index,
+        "operation": edit.operation,
+        "params": edit.params,
+        "preview": edit.preview
+    })
+
+
+def _apply_queued_adds(
+    session: PresentationSession,
+    slides: list[Slide],
+    queued_adds: list[tuple[PendingEdit, Slide]],
+) -> int:
+    """Insert queued ADD slides and record them, returning how many were applied."""
+    try:
+        _insert_slides(slides, [slide for _, slide in queued_adds])
+        inserted = queued_adds
+    except Exception:
+        # Fall back to inserting one at a time so a bad edit only fails itself
+        inserted = []
+        for edit, slide in queued_adds:
+            try:
+                if slide.index >= len(slides):
+                    slides.append(slide)
+                else:
+                    slides.insert(slide.index, slide)
+                inserted.append((edit, slide))
+            except Exception as e:
+                logger.error(f"Error applying edit {edit.edit_id}: {e}")
+
+    for edit, _ in inserted:
+        _record_applied_edit(session, edit)
+    return len(inserted)
+
+
 @tool("commit_edits", "Apply all pending edits to the presentation. No parameters required.", {"dummy": str})
-async def tool_commit_edits(args: dict[str, Any]) -> dict[str, Any]:
+def tool_commit_edits(session: PresentationSession, args: dict[str, Any]) -> dict[str, Any]:
     """Apply all pending edits."""
-    session = get_current_session()
-    if not session:
-        return {"error": "No active session"}
     if not session.presentation:
-        return {"error": "No presentation created"}
+        return _ERR_NO_PRESENTATION_CREATED
 
     applied_count = 0
+    slides = session.presentation.slides
+    # Slides from consecutive ADDs at increasing positions, inserted together
+    queued_adds: list[tuple[PendingEdit, Slide]] = []
 
     for edit in session.pending_edits:
+        if queued_adds and (
+            edit.operation != "ADD" or edit.slide_index <= queued_adds[-1][1].index
+        ):
+            applied_count += _apply_queued_adds(session, slides, queued_adds)
+            queued_adds = []
+
         try:
             if edit.operation == "ADD":
-                # Add new slide
-                slide = Slide(
+                # Add new slide; recorded once it is actually inserted
+                queued_adds.append((edit, Slide(
                     index=edit.slide_index,
                     html=edit.params.get("html", ""),
-                    layout=SlideLayout(edit.params.get("layout", "blank"))
-                )
-                # Insert at position
-                if edit.slide_index >= len(session.presentation.slides):
-                    session.presentation.slides.append(slide)
-                else:
-                    session.presentation.slides.insert(edit.slide_index, slide)
-                # Re-index all slides
-                for i, s in enumerate(session.presentation.slides):
-                    s.index = i
+                    layout=_LAYOUT_LOOKUP.get(edit.params.get("layout", "blank"), SlideLayout.BLANK)
+                )))
+                continue
 
             elif edit.operation == "UPDATE":
-                if 0 <= edit.slide_index < len(session.presentation.slides):
-                    session.presentation.slides[edit.slide_index].html = edit.params.get("html", "")
+                if 0 <= edit.slide_index < len(slides):
+                    slides[edit.slide_index].html = edit.params.get("html", "")
 
             elif edit.operation == "DELETE":
-                if 0 <= edit.slide_index < len(session.presentation.slides):
-                    del session.presentation.slides[edit.slide_index]
-                    # Re-index
-                    for i, s in enumerate(session.presentation.slides):
-                        s.index = i
+                if 0 <= edit.slide_index < len(slides):
+                    del slides[edit.slide_index]
 
             elif edit.operation == "REORDER":
                 to_index = edit.params.get("to_index", 0)
-                if 0 <= edit.slide_index < len(session.presentation.slides):
-                    slide = session.presentation.slides.pop(edit.slide_index)
-                    session.presentation.slides.insert(to_index, slide)
-                    # Re-index
-                    for i, s in enumerate(session.presentation.slides):
-                        s.index = i
-
-            session.applied_edits.append(edit.to_dict())
+                if 0 <= edit.slide_index < len(slides):
+                    slide = slides.pop(edit.slide_index)
+                    slides.insert(to_index, slide)
+
+            _record_applied_edit(session, edit)
             applied_count += 1
 
         except Exception as e:
             logger.error(f"Error applying edit {edit.edit_id}: {e}")
 
+    if queued_adds:
+        applied_count += _apply_queued_adds(session, slides, queued_adds)
+
+    # Re-index all slides once; edits address slides by list position
+    for i, s in enumerate(slides):
+        s.index = i
+
     # Clear pending edits
     session.pending_edits = []
+    session.pending_add_count = 0
 
     # Save session
     session_manager.save_session(session)
@@ -394,7 +460,7 @@ async def tool_commit_edits(args: dict[str, Any]) -> dict[str, Any]:
     return {
         "success": True,
         "applied_count": applied_count,
-        "total_slides": len(session.presentation.slides)
+        "total_slides": len(slides)
     }
 
 
@@ -462,20 +528,22 @@ Use list_slides first to understand the current state before making any changes.
 
 def _extract_slide_title_from_html(html: str) -> str:
     """Extract the title/heading from slide HTML content."""
-    import re
     if not html:
         return None
 
-    heading_match = re.search(r'<h[12][^>]*>([^<]+)</h[12]>', html, re.IGNORECASE)
-    if heading_match:
-        title = heading_match.group(1).strip()
-        title = ' '.join(title.split())
-        if len(title) > 60:
-            title = title[:57] + "..."
-        return title
+    # Plain text (e.g. partial content) has no headings or tags to strip
+    if '<' in html:
+        heading_match = _HEADING_RE.search(html)
+        if heading_match:
+            title = heading_match.group(1).strip()
+            title = ' '.join(title.split())
+            if len(title) > 60:
+                title = title[:57] + "..."
+            return title
+
+        html = _TAG_RE.sub(' ', html)
 
-    text = re.sub(r'<[^>]+>', ' ', html)
-    text = ' '.join(text.split()).strip()
+    text = ' '.join(html.split()).strip()
     if text:
         first_part = text[:60]
         if len(text) > 60:
@@ -487,34 +555,35 @@ def _extract_slide_title_from_html(html: str) -> str:
 
 def _extract_slide_content_from_html(html: str) -> str:
     """Extract full readable text content from slide HTML for display."""
-    import re
     if not html:
         return None
 
-    list_items = re.findall(r'<li[^>]*>(.*?)</li>', html, re.IGNORECASE | re.DOTALL)
-    paragraphs = re.findall(r'<p[^>]*>(.*?)</p>', html, re.IGNORECASE | re.DOTALL)
+    has_tags = '<' in html
     content_parts = []
 
-    for item in list_items:
-        item = re.sub(r'<[^>]+>', ' ', item)
-        item = ' '.join(item.split()).strip()
-        if item:
-            content_parts.append(f"• {item}")
+    if has_tags:
+        for item in _LI_RE.findall(html):
+            item = _TAG_RE.sub(' ', item)
+            item = ' '.join(item.split()).strip()
+            if item:
+                content_parts.append(f"• {item}")
 
-    if not content_parts:
-        for para in paragraphs:
-            para = re.sub(r'<[^>]+>', ' ', para)
-            para = ' '.join(para.split()).strip()
-            if para:
-                content_parts.append(para)
+        if not content_parts:
+            for para in _P_RE.findall(html):
+                para = _TAG_RE.sub(' ', para)
+                para = ' '.join(para.split()).strip()
+                if para:
+                    content_parts.append(para)
 
     if not content_parts:
-        text = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
-        text = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-        text = re.sub(r'<h[12][^>]*>.*?</h[12]>', '', text, flags=re.DOTALL | re.IGNORECASE)
-        text = re.sub(r'</(?:div|p|li|br)[^>]*>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'<[^>]+>', ' ', text)
+        text = html
+        if has_tags:
+            text = _SCRIPT_RE.sub('', text)
+            text = _STYLE_RE.sub('', text)
+            text = _H12_STRIP_RE.sub('', text)
+            text = _BLOCK_CLOSE_RE.sub('\n', text)
+            text = _BR_RE.sub('\n', text)
+            text = _TAG_RE.sub(' ', text)
         lines = [' '.join(line.split()).strip() for line in text.split('\n')]
         lines = [line for line in lines if line]
         if lines:
@@ -529,39 +598,144 @@ def _extract_slide_content_from_html(html: str) -> str:
     return None
 
 
+def _build_system_prompt(session: PresentationSession, is_continuation: bool) -> str:
+    """Build the system prompt, reusing the session's cached copy if its context is unchanged."""
+    cache_key = (session.context_version, is_continuation)
+    cached = session.prompt_cache.get("system_prompt")
+    if cached and cached[0] == cache_key:
+        return cached[1]
+
+    system_prompt = SYSTEM_PROMPT_CONTINUATION if is_continuation else SYSTEM_PROMPT_NEW
+
+    if session.context_files:
+        context_text = "\n\n".join([
+            f"=== {f['filename']} ===\n{f['text']}"
+            for f in session.context_files if f.get('text')
+        ])
+        if context_text:
+            system_prompt += f"\n\nCONTEXT FILES:\n{context_text}"
+
+    if session.style_template and session.style_template.get("text"):
+        system_prompt += f"\n\nSTYLE TEMPLATE REFERENCE:"
+        system_prompt += f"\nFilename: {session.style_template['filename']}"
+        system_prompt += f"\nTemplate content:\n{session.style_template['text']}"
+
+        if session.style_template.get("screenshots"):
+            system_prompt += f"\n\nStyle reference screenshots will be provided in the user message."
+
+    session.prompt_cache["system_prompt"] = (cache_key, system_prompt)
+    return system_prompt
+
+
+def _build_style_screenshot_content(session: PresentationSession) -> list[dict]:
+    """Build user message parts for the style template screenshots, cached per session context."""
+    cache_key = session.context_version
+    cached = session.prompt_cache.get("style_screenshots")
+    if cached and cached[0] == cache_key:
+        return cached[1]
+
+    content = []
+
+    # Add template screenshots if available
+    if session.style_template and session.style_template.get("screenshots"):
+        screenshots = session.style_template["screenshots"]
+        content.append({
+            "type": "text",
+            "text": f"STYLE TEMPLATE REFERENCE SCREENSHOTS:\nThe following {len(screenshots)} screenshots show the visual style you should emulate:"
+        })
+
+        for i, screenshot in enumerate(screenshots):
+            content.append({
+                "type": "text",
+                "text": f"\nSlide {screenshot.get('index', i) + 1}:"
+            })
+            # OpenAI uses "image_url" with base64
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{screenshot['data']}"
+                }
+            })
+
+    session.prompt_cache["style_screenshots"] = (cache_key, content)
+    return content
+
+
+async def _execute_tool(
+    session: PresentationSession,
+    tool_name: str,
+    tool_args: dict
+) -> dict[str, Any]:
+    """Run a registered tool, converting failures into an error result."""
+    func = TOOL_FUNCTIONS.get(tool_name)
+    if not func:
+        return {"error": f"Tool {tool_name} not found"}
+    try:
+        # Tools operate on in-memory session state and are plain functions;
+        # only await those that are actually coroutines.
+        if inspect.iscoroutinefunction(func):
+            return await func(session, tool_args)
+        return func(session, tool_args)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _friendly_create_presentation(tool_input: dict) -> tuple[str, str]:
+    title = tool_input.get("title", "Untitled")
+    return f"Creating presentation: {title}", None
+
+
+def _friendly_add_slide(tool_input: dict) -> tuple[str, str]:
+    html = tool_input.get("html", "")
+    slide_title = _extract_slide_title_from_html(html)
+    slide_content = _extract_slide_content_from_html(html)
+    friendly = f"Adding slide: {slide_title}" if slide_title else "Adding a new slide..."
+    return friendly, slide_content
+
+
+def _friendly_update_slide(tool_input: dict) -> tuple[str, str]:
+    idx = tool_input.get("slide_index", 0)
+    html = tool_input.get("html", "")
+    slide_title = _extract_slide_title_from_html(html)
+    slide_content = _extract_slide_content_from_html(html)
+    friendly = f"Updating slide {idx + 1}: {slide_title}" if slide_title else f"Updating slide {idx + 1}..."
+    return friendly, slide_content
+
+
+def _friendly_delete_slide(tool_input: dict) -> tuple[str, str]:
+    idx = tool_input.get("slide_index", 0)
+    return f"Deleting slide {idx + 1}", None
+
+
+def _friendly_get_slide(tool_input: dict) -> tuple[str, str]:
+    idx = tool_input.get("slide_index", 0)
+    return f"Getting slide {idx + 1} details...", None
+
+
+_FRIENDLY_DESCRIPTIONS = {
+    "create_presentation": _friendly_create_presentation,
+    "add_slide": _friendly_add_slide,
+    "update_slide": _friendly_update_slide,
+    "delete_slide": _friendly_delete_slide,
+    "list_slides": lambda tool_input: ("Listing all slides...", None),
+    "get_slide": _friendly_get_slide,
+    "commit_edits": lambda tool_input: ("Saving changes...", None),
+    "set_theme": lambda tool_input: ("Setting presentation theme...", None),
+}
+
+
+# HTML size (chars) above which friendly descriptions are built off the event loop
+_FRIENDLY_OFFLOAD_MIN_HTML = 2048
+
+
 def _get_friendly_tool_description(tool_name: str, tool_input: dict) -> tuple[str, str]:
     """Convert a tool call into a user-friendly description and details."""
     if not isinstance(tool_input, dict):
         return None, None
 
-    if "create_presentation" in tool_name:
-        title = tool_input.get("title", "Untitled")
-        return f"Creating presentation: {title}", None
-    elif "add_slide" in tool_name:
-        html = tool_input.get("html", "")
-        slide_title = _extract_slide_title_from_html(html)
-        slide_content = _extract_slide_content_from_html(html)
-        friendly = f"Adding slide: {slide_title}" if slide_title else "Adding a new slide..."
-        return friendly, slide_content
-    elif "update_slide" in tool_name:
-        idx = tool_input.get("slide_index", 0)
-        html = tool_input.get("html", "")
-        slide_title = _extract_slide_title_from_html(html)
-        slide_content = _extract_slide_content_from_html(html)
-        friendly = f"Updating slide {idx + 1}: {slide_title}" if slide_title else f"Updating slide {idx + 1}..."
-        return friendly, slide_content
-    elif "delete_slide" in tool_name:
-        idx = tool_input.get("slide_index", 0)
-        return f"Deleting slide {idx + 1}", None
-    elif "list_slides" in tool_name:
-        return "Listing all slides...", None
-    elif "get_slide" in tool_name:
-        idx = tool_input.get("slide_index", 0)
-        return f"Getting slide {idx + 1} details...", None
-    elif "commit_edits" in tool_name:
-        return "Saving changes...", None
-    elif "set_theme" in tool_name:
-        return "Setting presentation theme...", None
+    describe = _FRIENDLY_DESCRIPTIONS.get(tool_name)
+    if describe:
+        return describe(tool_input)
 
     return None, None
 
@@ -579,7 +753,8 @@ async def run_agent_stream(
     api_key: Optional[str] = None,
     base_url: Optional[str] = None,
     model: Optional[str] = "gpt-3.5-turbo",
-) -> AsyncGenerator[dict, None]:
+    emit_bytes: bool = False,
+) -> AsyncGenerator[dict | bytes, None]:
     """
     Run the agent and stream results using OpenAI SDK.
 
@@ -592,7 +767,37 @@ async def run_agent_stream(
         api_key: OpenAI API key
         base_url: OpenAI Base URL
         model: Model ID
+        emit_bytes: Yield each event as JSON-encoded bytes instead of a dict
     """
+    events = _run_agent_events(
+        instructions,
+        is_continuation,
+        resume_session_id,
+        user_session_id,
+        context_files,
+        api_key,
+        base_url,
+        model,
+    )
+    if emit_bytes:
+        async for event in events:
+            yield _json_dumps_event(event)
+    else:
+        async for event in events:
+            yield event
+
+
+async def _run_agent_events(
+    instructions: str,
+    is_continuation: bool,
+    resume_session_id: Optional[str],
+    user_session_id: Optional[str],
+    context_files: Optional[list[dict]],
+    api_key: Optional[str],
+    base_url: Optional[str],
+    model: Optional[str],
+) -> AsyncGenerator[dict, None]:
+    """Run the agent loop, yielding events as dicts. See run_agent_stream."""
     if not api_key:
         yield {"type": "error", "error": "API key is required"}
         return
@@ -607,11 +812,11 @@ async def run_agent_stream(
     # Get or create session
     session = session_manager.get_or_create_session(user_session_id)
 
-    if context_files:
+    # The client resends context files every turn; only replace them (and
+    # invalidate cached prompts) when they actually changed
+    if context_files and context_files != session.context_files:
         session.context_files = context_files
 
-    set_current_session(session)
-
     yield {"type": "init", "message": "Starting agent...", "session_id": session.session_id}
     yield {"type": "status", "message": "Connecting to OpenAI..."}
 
@@ -622,59 +827,22 @@ async def run_agent_stream(
 
         client = AsyncOpenAI(**client_kwargs)
 
-        # Build System Prompt
-        system_prompt = SYSTEM_PROMPT_CONTINUATION if is_continuation else SYSTEM_PROMPT_NEW
-
-        if session.context_files:
-            context_text = "\n\n".join([
-                f"=== {f['filename']} ===\n{f['text']}"
-                for f in session.context_files if f.get('text')
-            ])
-            if context_text:
-                system_prompt += f"\n\nCONTEXT FILES:\n{context_text}"
-
-        if session.style_template and session.style_template.get("text"):
-            system_prompt += f"\n\nSTYLE TEMPLATE REFERENCE:"
-            system_prompt += f"\nFilename: {session.style_template['filename']}"
-            system_prompt += f"\nTemplate content:\n{session.style_template['text']}"
-
-            if session.style_template.get("screenshots"):
-                system_prompt += f"\n\nStyle reference screenshots will be provided in the user message."
+        system_prompt = _build_system_prompt(session, is_continuation)
 
         # Initialize messages
         messages = [{"role": "system", "content": system_prompt}]
 
-        # Build User Message (Multimodal)
-        user_content = []
-
-        # Add template screenshots if available
-        if session.style_template and session.style_template.get("screenshots"):
-            screenshots = session.style_template["screenshots"]
-            user_content.append({
-                "type": "text",
-                "text": f"STYLE TEMPLATE REFERENCE SCREENSHOTS:\nThe following {len(screenshots)} screenshots show the visual style you should emulate:"
-            })
-
-            for i, screenshot in enumerate(screenshots):
-                user_content.append({
-                    "type": "text",
-                    "text": f"\nSlide {screenshot.get('index', i) + 1}:"
-                })
-                # OpenAI uses "image_url" with base64
-                user_content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{screenshot['data']}"
-                    }
-                })
-
-        user_content.append({"type": "text", "text": instructions})
+        # Build User Message (Multimodal): template screenshots, then instructions
+        user_content = [
+            *_build_style_screenshot_content(session),
+            {"type": "text", "text": instructions},
+        ]
 
         messages.append({"role": "user", "content": user_content})
 
         # Main Loop
         message_count = 0
-        final_result_text = ""
+        final_result_parts = []
 
         while True:
             print(f"[Agent Stream] Sending request to {model}...")
@@ -689,15 +857,15 @@ async def run_agent_stream(
             )
 
             current_tool_calls = {} # index -> {id, name, args_parts}
-            current_content = ""
+            current_content_parts = []
 
             async for chunk in response_stream:
                 delta = chunk.choices[0].delta
 
                 # Handle text content
                 if delta.content:
-                    current_content += delta.content
-                    final_result_text += delta.content
+                    current_content_parts.append(delta.content)
+                    final_result_parts.append(delta.content)
                     yield {
                         "type": "assistant",
                         "text": delta.content
@@ -711,7 +879,7 @@ async def run_agent_stream(
                             current_tool_calls[idx] = {
                                 "id": tc.id,
                                 "name": tc.function.name,
-                                "arguments": ""
+                                "args_parts": []
                             }
 
                         if tc.id:
@@ -719,7 +887,12 @@ async def run_agent_stream(
                         if tc.function.name:
                             current_tool_calls[idx]["name"] = tc.function.name
                         if tc.function.arguments:
-                            current_tool_calls[idx]["arguments"] += tc.function.arguments
+                            current_tool_calls[idx]["args_parts"].append(tc.function.arguments)
+
+            # Join streamed fragments once per turn rather than concatenating per chunk
+            current_content = "".join(current_content_parts)
+            for tc_data in current_tool_calls.values():
+                tc_data["arguments"] = "".join(tc_data.pop("args_parts"))
 
             # End of stream for this turn
             message_count += 1
@@ -752,24 +925,30 @@ async def run_agent_stream(
             # Execute tools
             yield {"type": "status", "message": "Executing tools..."}
 
-            tool_outputs_for_log = []
-
+            # Parse tool calls and notify frontend of tool use
+            tool_calls = []
             for idx in sorted(current_tool_calls.keys()):
                 tc_data = current_tool_calls[idx]
                 tool_name = tc_data["name"]
-                tool_id = tc_data["id"]
                 tool_args_str = tc_data["arguments"]
 
                 try:
-                    tool_args = json.loads(tool_args_str)
+                    tool_args = _json_loads(tool_args_str)
                 except json.JSONDecodeError:
                     tool_args = {}
                     print(f"Failed to parse tool arguments: {tool_args_str}")
 
-                # Notify frontend of tool use
-                friendly, details = _get_friendly_tool_description(tool_name, tool_args)
+                # Extracting text from large slide HTML runs in a worker thread so
+                # the event loop can keep serving other streams meanwhile
+                html = tool_args.get("html") if isinstance(tool_args, dict) else None
+                if isinstance(html, str) and len(html) > _FRIENDLY_OFFLOAD_MIN_HTML:
+                    friendly, details = await asyncio.to_thread(
+                        _get_friendly_tool_description, tool_name, tool_args
+                    )
+                else:
+                    friendly, details = _get_friendly_tool_description(tool_name, tool_args)
 
-                yield {
+                tool_use_event = {
                     "type": "tool_use",
                     "tool_calls": [{
                         "name": tool_name,
@@ -779,27 +958,35 @@ async def run_agent_stream(
                     }]
                 }
                 if friendly:
-                    yield {"type": "tool_use", "friendly": [friendly]}
+                    tool_use_event["friendly"] = [friendly]
                 if details:
-                    yield {"type": "tool_use", "details": [details]}
-
-                # Execute tool
-                func = TOOL_FUNCTIONS.get(tool_name)
-                if func:
-                    try:
-                        result = await func(tool_args)
-                    except Exception as e:
-                        result = {"error": str(e)}
-                else:
-                    result = {"error": f"Tool {tool_name} not found"}
-
-                tool_outputs_for_log.append(result)
-
-                # Append tool result to messages
+                    tool_use_event["details"] = [details]
+                yield tool_use_event
+
+                tool_calls.append((tc_data["id"], tool_name, tool_args))
+
+            # Execute tools. Consecutive read-only tools run concurrently, while
+            # mutating tools run one at a time in call order (e.g. add_slide
+            # derives its index from the edits staged before it).
+            results = []
+            read_batch = []
+            for _, tool_name, tool_args in tool_calls:
+                if tool_name in READ_ONLY_TOOLS:
+                    read_batch.append(_execute_tool(session, tool_name, tool_args))
+                    continue
+                if read_batch:
+                    results.extend(await asyncio.gather(*read_batch))
+                    read_batch = []
+                results.append(await _execute_tool(session, tool_name, tool_args))
+            if read_batch:
+                results.extend(await asyncio.gather(*read_batch))
+
+            # Append tool results to messages
+            for (tool_id, _, _), result in zip(tool_calls, results):
                 messages.append({
                     "role": "tool",
                     "tool_call_id": tool_id,
-                    "content": json.dumps(result)
+                    "content": _json_dumps(result)
                 })
 
             # Continue loop to let model react to tool outputs
@@ -811,9 +998,6 @@ async def run_agent_stream(
         yield {"type": "error", "error": f"Agent error: {str(e)}"}
         return
 
-    finally:
-        set_current_session(None)
-
     # Save session state
     # session.claude_session_id = ... # No persistent session ID needed for OpenAI REST API, we manage history in 'messages'
     session_manager.save_session(session)
@@ -822,7 +1006,7 @@ async def run_agent_stream(
     yield {
         "type": "complete",
         "success": True,
-        "result": final_result_text,
+        "result": "".join(final_result_parts),
         "message_count": message_count,
         "session_id": session.session_id, # Return our session ID
         "user_session_id": session.session_id,
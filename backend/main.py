@@ -53,6 +53,12 @@ async def lifespan(app: FastAPI):
 
     # Startup
     logger.info("Starting presentation app backend...")
+
+    # Run tasks eagerly where supported (Python 3.12+) so tasks that finish
+    # without suspending, such as in-memory tool calls, skip a loop iteration
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
     cleanup_task = asyncio.create_task(cleanup_old_sessions())
 
     yield
@@ -247,8 +253,9 @@ async def agent_stream(
                 api_key=api_key,
                 base_url=base_url,
                 model=model,
+                emit_bytes=True,
             ):
-                yield f"data: {json.dumps(message, default=str)}\n\n"
+                yield b"data: " + message + b"\n\n"
         except Exception as e:
             logger.error(f"Error in agent stream: {e}")
             yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
@@ -474,6 +481,7 @@ async def parse_files_endpoint(
     user_session_id: str = Form(...),
     parse_mode: str = Form("cost_effective"),
     api_key: Optional[str] = Form(None),
+    verbose_progress: bool = Form(True),
 ):
     """
     Parse uploaded files for context using LlamaParse.
@@ -500,7 +508,7 @@ async def parse_files_endpoint(
                     "content_type": file.content_type
                 })
 
-            async for event in parse_files_stream(file_contents, parse_mode):
+            async for event in parse_files_stream(file_contents, parse_mode, verbose_progress):
                 yield f"data: {json.dumps(event)}\n\n"
         except Exception as e:
             logger.error(f"Error parsing files: {e}")
@@ -70,7 +70,7 @@ class Presentation:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class PendingEdit:
     """Represents a staged edit that hasn't been committed yet."""
     edit_id: str
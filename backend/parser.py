@@ -5,9 +5,18 @@ Supports parsing various document formats (PDF, DOCX, etc.)
 to extract text content for presentation context.
 """
 
+import asyncio
+import base64
+import functools
+import hashlib
 import os
 import logging
-from typing import AsyncGenerator
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, TypeVar
+
+import httpx
 
 # Apply nest_asyncio to allow nested event loops (needed for LlamaParse)
 try:
@@ -18,6 +27,18 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Use pybase64 (SIMD-accelerated) for screenshot encoding if available
+try:
+    import pybase64
+
+    def _b64encode_str(data: bytes) -> str:
+        return pybase64.b64encode_as_string(data)
+except ImportError:
+    def _b64encode_str(data: bytes) -> str:
+        return base64.b64encode(data).decode('ascii')
+
 # Check if LlamaParse is available
 try:
     from llama_cloud_services import LlamaParse
@@ -26,17 +47,89 @@ except ImportError:
     LLAMAPARSE_AVAILABLE = False
     logger.warning("llama-cloud-services not installed. File parsing will be limited.")
 
+# Request timeout (seconds) for LlamaParse HTTP clients, matching its default
+LLAMAPARSE_TIMEOUT = 2000
+
+# Full page screenshots are named page_N.jpg (1-indexed)
+_PAGE_SCREENSHOT_PATTERN = re.compile(r'^page_(\d+)\.jpg$')
+
+# Retry policy for transient LlamaParse failures (rate limits, timeouts)
+LLAMAPARSE_MAX_ATTEMPTS = 4
+LLAMAPARSE_RETRY_MIN_WAIT = 2
+LLAMAPARSE_RETRY_MAX_WAIT = 30
+_TRANSIENT_ERROR_MARKERS = ("429", "rate limit", "quota", "timeout", "timed out")
+
+# Maximum number of files parsed at the same time
+PARSE_MAX_CONCURRENCY = int(os.environ.get("PARSE_MAX_CONCURRENCY", "5"))
+
+# Plain-text formats decoded in-process instead of sent to LlamaParse
+_FAST_EXTS = {'txt', 'md', 'markdown', 'csv', 'json', 'html', 'xml', 'rst'}
+
+# LlamaParse results keyed by content hash and parse settings, so re-uploads
+# of the same file skip the API call. Template entries hold screenshots, so
+# the cache is kept small.
+PARSE_CACHE_MAX_ENTRIES = 32
+_parse_cache: OrderedDict[str, Any] = OrderedDict()
+
+
+def _is_transient_error(e: Exception) -> bool:
+    """Check whether a LlamaParse failure is worth retrying."""
+    if isinstance(e, (httpx.TimeoutException, httpx.ConnectError)):
+        return True
+    message = str(e).lower()
+    return any(marker in message for marker in _TRANSIENT_ERROR_MARKERS)
+
+
+async def _call_with_retries(make_call: Callable[[], Awaitable[T]]) -> T:
+    """Await make_call(), retrying transient errors with exponential backoff."""
+    for attempt in range(1, LLAMAPARSE_MAX_ATTEMPTS + 1):
+        try:
+            return await make_call()
+        except Exception as e:
+            if attempt == LLAMAPARSE_MAX_ATTEMPTS or not _is_transient_error(e):
+                raise
+            wait = min(LLAMAPARSE_RETRY_MAX_WAIT, LLAMAPARSE_RETRY_MIN_WAIT * 2 ** (attempt - 1))
+            logger.warning("Transient LlamaParse error (%s), retrying in %ss", e, wait)
+            await asyncio.sleep(wait)
+
+
+def _parse_cache_key(content: bytes, *settings: str) -> str:
+    """Build a cache key from a hash of the file content and parse settings."""
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    return ":".join((digest, *settings))
+
+
+def _parse_cache_get(key: str) -> Any:
+    """Return a cached parse result, or None on a miss."""
+    value = _parse_cache.get(key)
+    if value is not None:
+        _parse_cache.move_to_end(key)
+    return value
+
+
+def _parse_cache_put(key: str, value: Any):
+    """Store a parse result, evicting the least recently used entries."""
+    _parse_cache[key] = value
+    _parse_cache.move_to_end(key)
+    while len(_parse_cache) > PARSE_CACHE_MAX_ENTRIES:
+        _parse_cache.popitem(last=False)
+
 
 async def parse_files_stream(
     files: list[dict],
-    parse_mode: str = "cost_effective"
+    parse_mode: str = "cost_effective",
+    verbose_progress: bool = True,
 ) -> AsyncGenerator[dict, None]:
     """
-    Parse uploaded files and stream progress.
+    Parse uploaded files concurrently and stream progress.
+
+    Progress events are yielded in the order they happen; the final
+    complete event lists results in the same order as the input files.
 
     Args:
         files: List of dicts with 'filename', 'content' (bytes), 'content_type'
         parse_mode: Parsing mode ('cost_effective' or 'premium')
+        verbose_progress: Also emit a 'parsing' event when each file starts
 
     Yields:
         Progress and result events
@@ -45,98 +138,171 @@ async def parse_files_stream(
         yield {"type": "complete", "results": []}
         return
 
-    results = []
     total = len(files)
+    results: list[dict] = [None] * total
+    # Progress events from all workers; None marks a finished worker
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(PARSE_MAX_CONCURRENCY)
 
-    for idx, file_data in enumerate(files):
+    # Try LlamaParse first if available
+    use_llama = LLAMAPARSE_AVAILABLE and bool(os.environ.get("LLAMA_CLOUD_API_KEY"))
+
+    async def parse_one(idx: int, file_data: dict):
         filename = file_data["filename"]
         content = file_data["content"]
         content_type = file_data.get("content_type", "")
 
-        yield {
-            "type": "progress",
-            "current": idx + 1,
-            "total": total,
-            "filename": filename,
-            "status": "parsing"
-        }
-
         try:
-            # Try LlamaParse first if available
-            if LLAMAPARSE_AVAILABLE and os.environ.get("LLAMA_CLOUD_API_KEY"):
-                parsed_text = await parse_with_llama(content, filename, parse_mode)
-            else:
-                # Fallback to basic parsing
-                parsed_text = parse_basic(content, filename, content_type)
-
-            results.append({
-                "filename": filename,
-                "text": parsed_text,
-                "success": True
-            })
-
-            yield {
-                "type": "progress",
-                "current": idx + 1,
-                "total": total,
-                "filename": filename,
-                "status": "complete"
-            }
+            async with semaphore:
+                if verbose_progress:
+                    await queue.put({
+                        "type": "progress",
+                        "current": idx + 1,
+                        "total": total,
+                        "filename": filename,
+                        "status": "parsing"
+                    })
+
+                try:
+                    if use_llama and _get_extension(filename) not in _FAST_EXTS:
+                        parsed_text = await parse_with_llama(content, filename, parse_mode)
+                    else:
+                        # Fallback to basic parsing
+                        parsed_text = parse_basic(content, filename, content_type)
+
+                    results[idx] = {
+                        "filename": filename,
+                        "text": parsed_text,
+                        "success": True
+                    }
+
+                    await queue.put({
+                        "type": "progress",
+                        "current": idx + 1,
+                        "total": total,
+                        "filename": filename,
+                        "status": "complete"
+                    })
+
+                except Exception as e:
+                    logger.error("Error parsing %s: %s", filename, e)
+                    results[idx] = {
+                        "filename": filename,
+                        "text": "",
+                        "success": False,
+                        "error": str(e)
+                    }
+
+                    await queue.put({
+                        "type": "progress",
+                        "current": idx + 1,
+                        "total": total,
+                        "filename": filename,
+                        "status": "error",
+                        "error": str(e)
+                    })
+        finally:
+            await queue.put(None)
 
-        except Exception as e:
-            logger.error(f"Error parsing {filename}: {e}")
-            results.append({
-                "filename": filename,
-                "text": "",
-                "success": False,
-                "error": str(e)
-            })
-
-            yield {
-                "type": "progress",
-                "current": idx + 1,
-                "total": total,
-                "filename": filename,
-                "status": "error",
-                "error": str(e)
-            }
+    tasks = [
+        asyncio.create_task(parse_one(idx, file_data))
+        for idx, file_data in enumerate(files)
+    ]
+
+    try:
+        finished = 0
+        while finished < total:
+            event = await queue.get()
+            if event is None:
+                finished += 1
+            else:
+                yield event
+    finally:
+        # Stop outstanding parses if the consumer goes away early
+        for task in tasks:
+            task.cancel()
 
     yield {"type": "complete", "results": results}
 
 
+# LlamaParse clients are cached per API key (requests may switch the key via
+# the environment) and each gets its own httpx client, so repeated parses
+# reuse pooled connections to LlamaCloud instead of reconnecting per file.
+
+@functools.lru_cache(maxsize=4)
+def _get_text_parser(api_key: str) -> "LlamaParse":
+    """Get the shared LlamaParse client for extracting context file text."""
+    return LlamaParse(
+        api_key=api_key,
+        result_type="markdown",
+        parsing_instruction="Extract all text content for use in presentation slides.",
+        # Raise failures instead of returning no documents, so transient
+        # errors get retried and hard ones are reported for the file
+        ignore_errors=False,
+        custom_client=httpx.AsyncClient(timeout=LLAMAPARSE_TIMEOUT),
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _get_template_parser(api_key: str, tier: str) -> "LlamaParse":
+    """Get the shared LlamaParse client for parsing templates with screenshots."""
+    # Configure LlamaParse with new tier-based API
+    return LlamaParse(
+        api_key=api_key,
+        tier=tier,
+        version="latest",
+        output_tables_as_HTML=True,
+        precise_bounding_box=True,
+        page_separator="\n\n---\n\n",
+        take_screenshot=True,
+        custom_client=httpx.AsyncClient(timeout=LLAMAPARSE_TIMEOUT),
+    )
+
+
+def _join_document_texts(documents: list) -> str:
+    """Join the text of parsed documents, separated by blank lines."""
+    texts = [doc.text for doc in documents]
+    if len(texts) == 1:
+        return texts[0]
+    return "\n\n".join(texts)
+
+
 async def parse_with_llama(
     content: bytes,
     filename: str,
     parse_mode: str
 ) -> str:
     """Parse file using LlamaParse."""
-    from llama_cloud_services import LlamaParse
+    cache_key = _parse_cache_key(content, "text", parse_mode)
+    cached = _parse_cache_get(cache_key)
+    if cached is not None:
+        return cached
 
-    parser = LlamaParse(
-        result_type="markdown",
-        parsing_instruction="Extract all text content for use in presentation slides."
+    parser = _get_text_parser(os.environ["LLAMA_CLOUD_API_KEY"])
+
+    # Upload the bytes directly; LlamaParse needs the file name for its type
+    documents = await _call_with_retries(
+        lambda: parser.aload_data(content, extra_info={"file_name": filename})
     )
+    text = _join_document_texts(documents)
+    # Don't cache an empty parse, so a re-upload tries again
+    if documents:
+        _parse_cache_put(cache_key, text)
+    return text
 
-    # Write to temp file
-    import tempfile
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{filename}") as f:
-        f.write(content)
-        temp_path = f.name
 
-    try:
-        documents = await parser.aload_data(temp_path)
-        return "\n\n".join(doc.text for doc in documents)
-    finally:
-        import os
-        os.unlink(temp_path)
+def _get_extension(filename: str) -> str:
+    """Get the lowercased extension of a filename, without the dot."""
+    return os.path.splitext(filename)[1][1:].lower()
 
 
 def parse_basic(content: bytes, filename: str, content_type: str) -> str:
     """Basic parsing fallback for common formats."""
-    ext = filename.lower().split('.')[-1] if '.' in filename else ''
-
-    # Plain text files
-    if ext in ['txt', 'md', 'markdown'] or 'text/' in content_type:
+    # Plain text files; trust a text/* content type before sniffing the name
+    is_text = bool(content_type) and content_type.startswith('text/')
+    if is_text or _get_extension(filename) in _FAST_EXTS:
+        if content.isascii():
+            return content.decode('ascii')
         try:
             return content.decode('utf-8')
         except UnicodeDecodeError:
@@ -146,6 +312,18 @@ def parse_basic(content: bytes, filename: str, content_type: str) -> str:
     return f"[Content from {filename} - requires LlamaParse for full extraction]"
 
 
+def _get_image_name(img: Any) -> Optional[str]:
+    """Get the name of a parsed page image (SDK object or dict)."""
+    try:
+        return img.name
+    except AttributeError:
+        pass
+    try:
+        return img['name']
+    except (KeyError, TypeError):
+        return None
+
+
 async def parse_template_with_screenshots(
     content: bytes,
     filename: str,
@@ -168,10 +346,6 @@ async def parse_template_with_screenshots(
             "error": str | None
         }
     """
-    import tempfile
-    import base64
-    import re
-
     if not LLAMAPARSE_AVAILABLE or not os.environ.get("LLAMA_CLOUD_API_KEY"):
         return {
             "filename": filename,
@@ -181,129 +355,126 @@ async def parse_template_with_screenshots(
             "error": "LlamaParse not available for template parsing. Set LLAMA_CLOUD_API_KEY."
         }
 
-    try:
-        from llama_cloud_services import LlamaParse
-
-        # Configure LlamaParse with new tier-based API
-        parser = LlamaParse(
-            tier=tier,
-            version="latest",
-            output_tables_as_HTML=True,
-            precise_bounding_box=True,
-            page_separator="\n\n---\n\n",
-            take_screenshot=True,
-        )
+    cache_key = _parse_cache_key(content, "template", tier)
+    cached = _parse_cache_get(cache_key)
+    if cached is not None:
+        return {**cached, "filename": filename}
 
-        # Write to temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{filename}") as f:
-            f.write(content)
-            temp_path = f.name
+    try:
+        parser = _get_template_parser(os.environ["LLAMA_CLOUD_API_KEY"], tier)
 
-        try:
-            # Parse document - use aparse to get JobResult object
-            result = await parser.aparse(temp_path)
+        # Parse document - use aparse to get JobResult object
+        result = await _call_with_retries(
+            lambda: parser.aparse(content, extra_info={"file_name": filename})
+        )
 
-            # Get text content from markdown documents
-            markdown_docs = result.get_markdown_documents(split_by_page=False)
-            text_content = "\n\n".join(doc.text for doc in markdown_docs) if markdown_docs else ""
+        # Get text content from markdown documents
+        markdown_docs = result.get_markdown_documents(split_by_page=False)
+        text_content = _join_document_texts(markdown_docs) if markdown_docs else ""
 
-            # Extract screenshots using async method to fetch image data
-            screenshots = []
+        # Extract screenshots using async method to fetch image data
+        screenshots = []
+        selected = []
+        # Only cache results where every selected screenshot was fetched
+        screenshots_complete = False
 
-            # Create a debug directory to save screenshots
-            debug_dir = "/tmp/template_screenshots"
+        # Optionally save screenshots to a debug directory
+        debug_enabled = bool(os.environ.get("LLAMAPARSE_DEBUG_SCREENSHOTS"))
+        debug_dir = "/tmp/template_screenshots"
+        if debug_enabled:
             os.makedirs(debug_dir, exist_ok=True)
-            logger.info(f"Saving debug screenshots to: {debug_dir}")
-
-            # Pattern to match full page screenshots: page_N.jpg (1-indexed)
-            page_screenshot_pattern = re.compile(r'^page_(\d+)\.jpg$')
-
-            try:
-                if result.pages:
-                    logger.info(f"Found {len(result.pages)} pages in result")
-
-                    # Collect only full page screenshots from all pages
-                    page_screenshots = []
-                    for page_idx, page in enumerate(result.pages):
-                        if hasattr(page, 'images') and page.images:
-                            logger.info(f"Page {page_idx}: found {len(page.images)} images")
-                            for img in page.images:
-                                # Handle SDK objects - access .name attribute
-                                img_name = getattr(img, 'name', None)
-                                if img_name is None and hasattr(img, '__getitem__'):
-                                    # Fallback to dict access if needed
-                                    img_name = img.get('name') if isinstance(img, dict) else None
-
-                                if img_name:
-                                    match = page_screenshot_pattern.match(img_name)
-                                    if match:
-                                        # page_N.jpg is 1-indexed, convert to 0-indexed
-                                        page_num = int(match.group(1)) - 1
-                                        page_screenshots.append({
-                                            "page_idx": page_num,
-                                            "name": img_name
-                                        })
-                                        logger.info(f"Found full page screenshot: {img_name} for page {page_num}")
-                        else:
-                            logger.info(f"Page {page_idx}: no images found")
-
-                    logger.info(f"Total full page screenshots found: {len(page_screenshots)}")
-
-                    # Sort by page index and select representative screenshots (up to 5)
-                    page_screenshots.sort(key=lambda x: x["page_idx"])
-
-                    if page_screenshots:
-                        max_screenshots = 5
-                        step = max(1, len(page_screenshots) // max_screenshots)
-                        selected = page_screenshots[::step][:max_screenshots]
-                        logger.info(f"Selecting {len(selected)} page screenshots")
-
-                        for img_info in selected:
-                            img_name = img_info["name"]
-                            try:
-                                # Use async method to get image data
-                                logger.info(f"Fetching image: {img_name}")
-                                img_data = await result.aget_image_data(img_name)
-                                if img_data:
-                                    # Save to debug directory
+            logger.debug("Saving debug screenshots to: %s", debug_dir)
+
+        try:
+            if result.pages:
+                logger.debug("Found %s pages in result", len(result.pages))
+
+                # Collect only full page screenshots from all pages
+                page_screenshots = [
+                    # page_N.jpg is 1-indexed, convert to 0-indexed
+                    {"page_idx": int(match.group(1)) - 1, "name": img_name}
+                    for page in result.pages
+                    if getattr(page, 'images', None)
+                    for img in page.images
+                    if (img_name := _get_image_name(img))
+                    and (match := _PAGE_SCREENSHOT_PATTERN.match(img_name))
+                ]
+
+                logger.debug("Total full page screenshots found: %s", len(page_screenshots))
+
+                # Sort by page index and select representative screenshots (up to 5)
+                page_screenshots.sort(key=lambda x: x["page_idx"])
+
+                if page_screenshots:
+                    # Pick evenly spaced pages from first to last
+                    max_screenshots = 5
+                    n = len(page_screenshots)
+                    k = min(max_screenshots, n)
+                    selected = [
+                        page_screenshots[i * (n - 1) // max(k - 1, 1)]
+                        for i in range(k)
+                    ]
+                    logger.debug("Selecting %s page screenshots", len(selected))
+
+                    async def fetch_image(img_name: str):
+                        # Encode in a worker thread so large screenshots
+                        # don't block the event loop while others download
+                        img_data = await result.aget_image_data(img_name)
+                        if not img_data:
+                            return img_data, None
+                        return img_data, await asyncio.to_thread(_b64encode_str, img_data)
+
+                    # Fetch and encode all selected images concurrently
+                    fetched = await asyncio.gather(
+                        *(fetch_image(img_info["name"]) for img_info in selected),
+                        return_exceptions=True
+                    )
+
+                    for img_info, item in zip(selected, fetched):
+                        img_name = img_info["name"]
+                        if isinstance(item, Exception):
+                            logger.warning("Could not fetch image %s: %s", img_name, item)
+                            continue
+                        img_data, img_base64 = item
+                        try:
+                            if img_data:
+                                if debug_enabled:
                                     debug_path = os.path.join(debug_dir, img_name)
-                                    with open(debug_path, 'wb') as f:
-                                        f.write(img_data)
-                                    logger.info(f"Saved debug image to: {debug_path}")
-
-                                    # img_data should be bytes, encode to base64
-                                    img_base64 = base64.b64encode(img_data).decode('utf-8')
-                                    screenshots.append({
-                                        "index": img_info["page_idx"],
-                                        "data": img_base64,
-                                    })
-                                    logger.info(f"Successfully fetched image {img_name} ({len(img_data)} bytes)")
-                                else:
-                                    logger.warning(f"No data returned for image {img_name}")
-                            except Exception as img_err:
-                                logger.warning(f"Could not fetch image {img_name}: {img_err}")
-                else:
-                    logger.info("No pages in result")
-
-                logger.info(f"Final screenshot count: {len(screenshots)}")
-
-            except Exception as e:
-                logger.warning(f"Could not extract screenshots: {e}")
-                # Continue without screenshots - text is still valuable
-
-            return {
-                "filename": filename,
-                "text": text_content,
-                "screenshots": screenshots,
-                "success": True,
-                "error": None
-            }
+                                    await asyncio.to_thread(Path(debug_path).write_bytes, img_data)
+                                    logger.debug("Saved debug image to: %s", debug_path)
+
+                                screenshots.append({
+                                    "index": img_info["page_idx"],
+                                    "data": img_base64,
+                                })
+                                logger.debug("Successfully fetched image %s (%s bytes)", img_name, len(img_data))
+                            else:
+                                logger.warning("No data returned for image %s", img_name)
+                        except Exception as img_err:
+                            logger.warning("Could not fetch image %s: %s", img_name, img_err)
+            else:
+                logger.debug("No pages in result")
 
-        finally:
-            os.unlink(temp_path)
+            logger.debug("Final screenshot count: %s", len(screenshots))
+            screenshots_complete = len(screenshots) == len(selected)
+
+        except Exception as e:
+            logger.warning("Could not extract screenshots: %s", e)
+            # Continue without screenshots - text is still valuable
+
+        parsed = {
+            "filename": filename,
+            "text": text_content,
+            "screenshots": screenshots,
+            "success": True,
+            "error": None
+        }
+        if screenshots_complete:
+            _parse_cache_put(cache_key, parsed)
+        return {**parsed}
 
     except Exception as e:
-        logger.error(f"Error parsing template {filename}: {e}")
+        logger.error("Error parsing template %s: %s", filename, e)
         return {
             "filename": filename,
             "text": "",
@@ -35,18 +35,43 @@ class PresentationSession:
         self.session_id = session_id or str(uuid.uuid4())
         self.presentation: Optional[Presentation] = None
         self.pending_edits: list[PendingEdit] = []
+        self.pending_add_count: int = 0  # Number of ADD edits in pending_edits
         self.applied_edits: list[dict] = []
-        self.context_files: list[dict] = []
-        self.style_template: Optional[dict] = None  # {filename, text, screenshots}
+        self._context_files: list[dict] = []
+        self._style_template: Optional[dict] = None  # {filename, text, screenshots}
+        # Bumped whenever context_files or style_template is replaced
+        self.context_version: int = 0
+        # Prompt pieces derived from the context, cached by the agent as
+        # {name: (key, value)} where key includes context_version
+        self.prompt_cache: dict = {}
         self.is_continuation: bool = False
         self.agent_session_id: Optional[str] = None
         self.created_at: datetime = datetime.now()
         self.updated_at: datetime = datetime.now()
 
+    @property
+    def context_files(self) -> list[dict]:
+        return self._context_files
+
+    @context_files.setter
+    def context_files(self, value: list[dict]):
+        self._context_files = value
+        self.context_version += 1
+
+    @property
+    def style_template(self) -> Optional[dict]:
+        return self._style_template
+
+    @style_template.setter
+    def style_template(self, value: Optional[dict]):
+        self._style_template = value
+        self.context_version += 1
+
     def reset(self):
         """Full reset - clear everything."""
         self.presentation = None
         self.pending_edits = []
+        self.pending_add_count = 0
         self.applied_edits = []
         self.context_files = []
         self.style_template = None
@@ -56,6 +81,7 @@ class PresentationSession:
     def soft_reset(self):
         """Soft reset - keep presentation, clear pending edits."""
         self.pending_edits = []
+        self.pending_add_count = 0
         self.updated_at = datetime.now()
 
     def to_dict(self) -> dict:
@@ -82,6 +108,9 @@ class PresentationSession:
         session.pending_edits = [
             PendingEdit.from_dict(e) for e in data.get("pending_edits", [])
         ]
+        session.pending_add_count = sum(
+            1 for e in session.pending_edits if e.operation == "ADD"
+        )
         session.applied_edits = data.get("applied_edits", [])
         session.context_files = data.get("context_files", [])
         session.style_template = data.get("style_template")